@@ -0,0 +1,288 @@
+"""Benchmarks for the hot paths of RotatingLog and PackedRotatingLog.
+
+Run from the repository root:
+
+    python benchmarks/run.py --json results.json
+    python benchmarks/run.py --latency 0.2  # simulate a slow filesystem
+
+Logs are written to tmpfs (/dev/shm) where available, so the numbers measure
+the library rather than the disk.  --latency adds a fixed delay in ms to every
+open, read, write, rename and remove, roughly imitating flash on a device.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from packing import packed, text  # noqa: E402
+from packing.packed import PackedRotatingLog  # noqa: E402
+from packing.text import RotatingLog  # noqa: E402
+
+
+class SlowFile:
+    def __init__(self, f, latency):
+        self._f = f
+        self._latency = latency
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._f.close()
+
+    def __iter__(self):
+        return iter(self._f)
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+    def read(self, *args):
+        time.sleep(self._latency)
+        return self._f.read(*args)
+
+    def readline(self, *args):
+        time.sleep(self._latency)
+        return self._f.readline(*args)
+
+    def write(self, data):
+        time.sleep(self._latency)
+        return self._f.write(data)
+
+
+class SlowFS:
+    # shadows open() and os in the packing modules with delayed versions
+    def __init__(self, latency):
+        self.latency = latency
+
+    def _open(self, *args, **kwargs):
+        time.sleep(self.latency)
+        return SlowFile(open(*args, **kwargs), self.latency)
+
+    def _delayed(self, fn):
+        def delayed(*args, **kwargs):
+            time.sleep(self.latency)
+            return fn(*args, **kwargs)
+
+        return delayed
+
+    def __enter__(self):
+        if not self.latency:
+            return self
+        slow_os = type("SlowOS", (), {})()
+        for name in dir(os):
+            if not name.startswith("_"):
+                setattr(slow_os, name, getattr(os, name))
+        for name in ("rename", "remove", "unlink", "stat", "listdir"):
+            setattr(slow_os, name, self._delayed(getattr(os, name)))
+        for module in (text, packed):
+            module.open = self._open
+            module.os = slow_os
+        return self
+
+    def __exit__(self, *args):
+        if not self.latency:
+            return
+        for module in (text, packed):
+            del module.open
+            module.os = os
+
+
+def tmpdir():
+    root = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    return tempfile.mkdtemp(prefix="packing-bench-", dir=root)
+
+
+def timed(fn, repeat):
+    # best of repeat, each run on a fresh directory
+    best = None
+    for _ in range(repeat):
+        d = tmpdir()
+        try:
+            setup = fn(d)
+            start = time.perf_counter()
+            n = setup()
+            elapsed = time.perf_counter() - start
+        finally:
+            shutil.rmtree(d)
+        if best is None or elapsed < best[0]:
+            best = (elapsed, n)
+    return best
+
+
+def packer(d, **kwargs):
+    kwargs.setdefault("log_lines", 1000)
+    return PackedRotatingLog("log", d, 4, 2, 8, **kwargs)
+
+
+def record(i):
+    return dict(floats=[i, i / 2, i / 3, i / 4], ints=[i, -i], bools=[i % 2] * 8)
+
+
+def fill(log, lines):
+    if isinstance(log, PackedRotatingLog):
+        for i in range(lines):
+            log.append(**record(i))
+    else:
+        for i in range(lines):
+            log.append("line {}".format(i))
+
+
+def bench_text_append(lines):
+    def setup(d):
+        log = RotatingLog("log", d, log_lines=1000)
+        return lambda: fill(log, lines) or lines
+
+    return setup
+
+
+def bench_packed_append(lines):
+    def setup(d):
+        log = packer(d)
+        return lambda: fill(log, lines) or lines
+
+    return setup
+
+
+def bench_rotate(keep_logs):
+    def setup(d):
+        log = packer(d, log_lines=10, keep_logs=keep_logs)
+        fill(log, 10 * (keep_logs + 1))
+
+        def run():
+            for _ in range(20):
+                log.rotate_logs()
+                log.append(**record(0))
+            return 20
+
+        return run
+
+    return setup
+
+
+def bench_read(cls, lines, skip):
+    def setup(d):
+        if cls is RotatingLog:
+            log = RotatingLog("log", d, log_lines=1000, keep_logs=10)
+        else:
+            log = packer(d, keep_logs=10)
+        fill(log, lines + skip)
+        return lambda: sum(1 for _ in log.read(n=lines, skip=skip))
+
+    return setup
+
+
+def bench_incorporate(history):
+    def setup(d):
+        fill(packer(d, keep_logs=history // 1000 + 1), history)
+        return lambda: packer(d, keep_logs=history // 1000 + 1).abs_pos or 1
+
+    return setup
+
+
+def bench_pack(lines):
+    def setup(d):
+        log = packer(d)
+        kwargs = record(3)
+
+        def run():
+            for _ in range(lines):
+                log.pack(**kwargs)
+            return lines
+
+        return run
+
+    return setup
+
+
+def bench_unpack(lines):
+    def setup(d):
+        log = packer(d)
+        line = log.pack(**record(3))
+
+        def run():
+            for _ in range(lines):
+                log.unpack(line)
+            return lines
+
+        return run
+
+    return setup
+
+
+def benchmarks(scale):
+    lines = 10000 // scale
+    yield "text_append", {"lines": lines}, bench_text_append(lines)
+    yield "packed_append", {"lines": lines}, bench_packed_append(lines)
+    for keep_logs in (1, 4, 16, 64):
+        yield "rotate_logs", {"keep_logs": keep_logs}, bench_rotate(keep_logs)
+    for cls in (RotatingLog, PackedRotatingLog):
+        for skip in (0, 100, 5000 // scale):
+            yield (
+                "{}_read".format("packed" if cls is PackedRotatingLog else "text"),
+                {"lines": 1000 // scale, "skip": skip},
+                bench_read(cls, 1000 // scale, skip),
+            )
+    for history in (1000, 10000, 50000):
+        history //= scale
+        yield "incorporate_logs", {"history": history}, bench_incorporate(history)
+    yield "pack", {"lines": lines}, bench_pack(lines)
+    yield "unpack", {"lines": lines}, bench_unpack(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--latency", type=float, default=0, help="ms added to each fs call"
+    )
+    parser.add_argument("--quick", action="store_true", help="10x smaller runs")
+    parser.add_argument("-k", help="only run benchmarks whose name contains this")
+    args = parser.parse_args(argv)
+
+    results = []
+    with SlowFS(args.latency / 1000):
+        for name, params, bench in benchmarks(10 if args.quick else 1):
+            if args.k and args.k not in name:
+                continue
+            elapsed, n = timed(bench, args.repeat)
+            results.append(
+                dict(
+                    name=name,
+                    params=params,
+                    ops=n,
+                    seconds=elapsed,
+                    us_per_op=elapsed / n * 1e6,
+                )
+            )
+            print(
+                "{:<18} {:<28} {:>10.2f} us/op".format(
+                    name, json.dumps(params), results[-1]["us_per_op"]
+                )
+            )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(
+                dict(
+                    python=sys.version,
+                    platform=platform.platform(),
+                    time=time.time(),
+                    latency_ms=args.latency,
+                    repeat=args.repeat,
+                    results=results,
+                ),
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
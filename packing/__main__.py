@@ -0,0 +1,325 @@
+"""Export or convert a directory of logs pulled from a device.
+
+    python -m packing export OUTDIR --packed 2 2 8 --format csv -o log.csv
+    python -m packing export OUTDIR --format ndjson
+    python -m packing export OUTDIR --packed 2 2 8 --format raw -o log
+    python -m packing convert OUTDIR NEWDIR --to-packed 2 2 8
+
+Everything is streamed oldest line first, so memory use does not depend on
+the size of the logs.
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+from .packed import PackedRotatingLog
+from .text import RotatingLog
+
+BUFFER = 1 << 20
+
+
+def add_log_args(parser, prefix=""):
+    dest = prefix.replace("-", "_")
+    parser.add_argument(
+        "--{}packed".format(prefix),
+        nargs=3,
+        type=int,
+        metavar=("FLOATS", "INTS", "BOOLS"),
+        dest="{}packed".format(dest),
+        help="packed log layout; text log if omitted",
+    )
+    parser.add_argument(
+        "--{}timestamp".format(prefix),
+        action="store_true",
+        dest="{}timestamp".format(dest),
+    )
+    parser.add_argument(
+        "--{}checksum".format(prefix),
+        action="store_true",
+        dest="{}checksum".format(dest),
+    )
+    parser.add_argument(
+        "--{}log-lines".format(prefix),
+        type=int,
+        default=100,
+        dest="{}log_lines".format(dest),
+    )
+    parser.add_argument(
+        "--{}keep-logs".format(prefix),
+        type=int,
+        dest="{}keep_logs".format(dest),
+        help="defaults to every file in the directory",
+    )
+
+
+def open_log(outdir, name, packed, timestamp, checksum, log_lines, keep_logs):
+    # read-only, so nothing in outdir is recovered, rotated or removed; a
+    # layout which doesn't fit the files on disk is refused.
+    if keep_logs is None:
+        ext = ".bin" if packed else ".log"
+        logs = [
+            int(fn[len(name) + 1 : -len(ext)])
+            for fn in os.listdir(outdir)
+            if fn.startswith(name + "_")
+            and fn.endswith(ext)
+            and fn[len(name) + 1 : -len(ext)].isdigit()
+        ]
+        keep_logs = max(logs + [1])
+    kwargs = dict(
+        log_lines=log_lines, keep_logs=keep_logs, timestamp=timestamp, readonly=True
+    )
+    try:
+        if packed:
+            log = PackedRotatingLog(name, outdir, *packed, checksum=checksum, **kwargs)
+        else:
+            log = RotatingLog(name, outdir, **kwargs)
+    except ValueError as e:
+        raise SystemExit("{}: check the log layout options".format(e))
+    if log.torn_tail:
+        # what a power cut mid-write leaves; everything before it is intact
+        print(
+            "warning: ignoring a partial record of {} bytes at the end of {}".format(
+                log.torn_tail, log.logf()
+            ),
+            file=sys.stderr,
+        )
+    return log
+
+
+def epoch(timestamp):
+    if isinstance(timestamp, time.struct_time):
+        return round(time.mktime(timestamp))
+    return timestamp
+
+
+def rows(log):
+    # (id, timestamp, values...) oldest first
+    n = log.abs_pos
+    if isinstance(log, PackedRotatingLog):
+        for id, floats, ints, bools, timestamp in log.read(n=n, tuples=True):
+            yield (id, epoch(timestamp)) + floats + ints + bools[: log.bools]
+    else:
+        for line in log.read(n=n):
+            yield line.id, epoch(line.timestamp), line.line
+
+
+def header(log):
+    if isinstance(log, PackedRotatingLog):
+        return ("id", "timestamp") + tuple(x for x in log.fields if x != "timestamp")
+    return ("id", "timestamp", "line")
+
+
+def export_csv(log, out):
+    writer = csv.writer(out)
+    writer.writerow(header(log))
+    writer.writerows(rows(log))
+
+
+def export_ndjson(log, out):
+    if isinstance(log, PackedRotatingLog):
+        for id, floats, ints, bools, timestamp in log.read(n=log.abs_pos, tuples=True):
+            record = dict(
+                id=id,
+                timestamp=epoch(timestamp),
+                floats=floats,
+                ints=ints,
+                bools=bools[: log.bools],
+            )
+            out.write(json.dumps(record))
+            out.write("\n")
+    else:
+        for line in log.read(n=log.abs_pos):
+            record = dict(id=line.id, timestamp=epoch(line.timestamp), line=line.line)
+            out.write(json.dumps(record))
+            out.write("\n")
+
+
+def export_raw(log, prefix):
+    # one file per column, plus a json description of them
+    if not isinstance(log, PackedRotatingLog):
+        raise SystemExit("raw export needs a packed log")
+    columns = ["floats", "ints", "bools"]
+    if log.timestamp:
+        columns.append("timestamps")
+    files = {
+        x: open("{}.{}".format(prefix, x), "wb", buffering=BUFFER) for x in columns
+    }
+    count, first = 0, None
+    try:
+        for block in log.read_blocks(n=log.abs_pos, block_size=4096):
+            if first is None:
+                first = block.id
+            count += block.count
+            for x in columns:
+                files[x].write(getattr(block, x))
+    finally:
+        for f in files.values():
+            f.close()
+    with open("{}.json".format(prefix), "w") as f:
+        json.dump(
+            dict(
+                first_id=first,
+                count=count,
+                floats=dict(per_record=log.floats, type="f"),
+                ints=dict(per_record=log.ints, type="i"),
+                bools=dict(per_record=log.bools, bytes_per_record=log.bool_bytes),
+                timestamps=dict(type="l") if log.timestamp else None,
+                byteorder=sys.byteorder,
+            ),
+            f,
+            indent=2,
+        )
+
+
+def fit(values, n, fill):
+    values = tuple(values[:n])
+    return values + (fill,) * (n - len(values))
+
+
+def logf_of(log, id):
+    # the file holding line id
+    first = log.abs_pos - log.pos
+    if id >= first:
+        return log.logf()
+    return log.logf(1 + (first - 1 - id) // log.log_lines)
+
+
+def records(src, dest):
+    # (floats, ints, bools, timestamp) in dest's layout, oldest first
+    n = src.abs_pos
+    if isinstance(src, PackedRotatingLog):
+        for _, floats, ints, bools, timestamp in src.read(n=n, tuples=True):
+            yield (
+                fit(floats, dest.floats, 0.0),
+                fit(ints, dest.ints, 0),
+                fit(bools[: src.bools], dest.bools, False),
+                epoch(timestamp),
+            )
+        return
+
+    # text lines are comma separated floats, then ints, then bools
+    for line in src.read(n=n):
+        values = (line.line or "").split(",")
+        try:
+            floats = [float(x) for x in values[: dest.floats]]
+            values = values[dest.floats :]
+            ints = [int(x) for x in values[: dest.ints]]
+        except ValueError as e:
+            raise SystemExit(
+                "{}: line {}: {}".format(logf_of(src, line.id), line.id, e)
+            )
+        bools = [x.strip() not in ("", "0", "False") for x in values[dest.ints :]]
+        yield (
+            fit(floats, dest.floats, 0.0),
+            fit(ints, dest.ints, 0),
+            fit(bools, dest.bools, False),
+            epoch(line.timestamp),
+        )
+
+
+def convert(src, dest):
+    # lay records out as if dest had appended them, writing each file once
+    total = min(src.abs_pos, dest.max_lines)
+    skip = src.abs_pos - total
+    files = (total + dest.log_lines - 1) // dest.log_lines
+    f, written = None, 0
+    try:
+        for i, (floats, ints, bools, timestamp) in enumerate(records(src, dest)):
+            if i < skip:
+                continue
+            if not written % dest.log_lines:
+                if f:
+                    f.close()
+                f = open(dest.logf(files - 1 - written // dest.log_lines), "wb", BUFFER)
+            f.write(dest.pack(floats, ints, bools, timestamp=timestamp))
+            written += 1
+    finally:
+        if f:
+            f.close()
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m packing", description=__doc__.splitlines()[0]
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="dump logs as csv, ndjson or raw")
+    export.add_argument("outdir")
+    export.add_argument("--name", default="log")
+    add_log_args(export)
+    export.add_argument("--format", choices=("csv", "ndjson", "raw"), default="csv")
+    export.add_argument(
+        "-o", "--output", default="-", help="file, or prefix for raw; - for stdout"
+    )
+
+    conv = commands.add_parser("convert", help="re-pack logs into a new directory")
+    conv.add_argument("outdir")
+    conv.add_argument("dest")
+    conv.add_argument("--name", default="log")
+    conv.add_argument("--to-name")
+    add_log_args(conv)
+    add_log_args(conv, prefix="to-")
+
+    args = parser.parse_args(argv)
+    src = open_log(
+        args.outdir,
+        args.name,
+        args.packed,
+        args.timestamp,
+        args.checksum,
+        args.log_lines,
+        args.keep_logs,
+    )
+
+    if args.command == "export":
+        if args.format == "raw":
+            if args.output == "-":
+                raise SystemExit("raw export needs an --output prefix")
+            export_raw(src, args.output)
+            return
+        exporter = export_csv if args.format == "csv" else export_ndjson
+        if args.output == "-":
+            try:
+                exporter(src, sys.stdout)
+                sys.stdout.flush()
+            except BrokenPipeError:
+                # the reader went away, e.g. piped into head
+                os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+                raise SystemExit(1)
+        else:
+            with open(args.output, "w", buffering=BUFFER, newline="") as out:
+                exporter(src, out)
+        return
+
+    if not args.to_packed:
+        raise SystemExit("convert needs --to-packed FLOATS INTS BOOLS")
+    os.makedirs(args.dest, exist_ok=True)
+    name = args.to_name or args.name
+    if any(fn.startswith(name) for fn in os.listdir(args.dest)):
+        raise SystemExit("{} already has logs in it".format(args.dest))
+    keep_logs = args.to_keep_logs
+    if keep_logs is None:
+        # one spare, so log_0 can be full and still be reopened intact
+        keep_logs = max(src.abs_pos - 1, 0) // args.to_log_lines + 1
+    dest = PackedRotatingLog(
+        name,
+        args.dest,
+        *args.to_packed,
+        checksum=args.to_checksum,
+        timestamp=args.to_timestamp,
+        log_lines=args.to_log_lines,
+        keep_logs=keep_logs,
+        incorporate=False,
+    )
+    convert(src, dest)
+    return dest
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import time
+from .text import RotatingLog, Line, nofileerror, os
+from .util import varint, unpack_varint
+
+CHUNK = 4096
+
+
+class BinaryRotatingLog(RotatingLog):
+    # Variable length records of str or bytes: a varint of the payload length
+    # shifted left one with the low bit set for bytes, a varint timestamp if
+    # timestamp is set, then the payload.  Nothing is truncated or escaped.
+    _unshipped = RotatingLog._unshipped + ("_offsets",)
+
+    def __init__(self, name, outdir, offsets=False, **kwargs):
+        # per-file record offsets, indexed like logf(); None where unknown
+        self._offsets = [] if offsets else None
+        self._size = 0  # bytes in log_0
+        super().__init__(name, outdir, ext="rec", **kwargs)
+
+    def add_timestamp(self, line):
+        # encodes the whole record, as pack() does for PackedRotatingLog
+        if isinstance(line, str):
+            payload = line.encode()
+            header = varint(len(payload) << 1)
+        else:
+            payload = line
+            header = varint(len(payload) << 1 | 1)
+        if self.timestamp:
+            header += varint(round(time.time()))
+        return header + payload
+
+    def _stored(self, line):
+        return line
+
+    def _raw_size(self, line):
+        return len(line)
+
+    def writeln(self, line):
+        if self._offsets and self._offsets[0] is not None:
+            self._offsets[0].append(self._size)
+        with open(self.logf(), "ab") as f:
+            f.write(line)
+        self._size += len(line)
+
+    def rotate_logs(self):
+        super().rotate_logs()
+        self._size = 0
+        if self._offsets is not None:
+            self._offsets.insert(0, [])
+            del self._offsets[self.keep_logs + 1 :]
+
+    def _records(self, f):
+        # (offset, end, header, timestamp, payload) for each complete record
+        buf, pos, start = b"", 0, f.tell()
+        while True:
+            if len(buf) - pos < 20:
+                start += pos
+                buf, pos = buf[pos:] + f.read(CHUNK), 0
+            try:
+                header, end = unpack_varint(buf, pos)
+                timestamp = None
+                if self.timestamp:
+                    timestamp, end = unpack_varint(buf, end)
+            except IndexError:
+                return
+            end += header >> 1
+            if end > len(buf):
+                start += pos
+                buf = buf[pos:] + f.read(end - len(buf) + CHUNK)
+                end, pos = end - pos, 0
+                if end > len(buf):
+                    return
+            payload = buf[end - (header >> 1) : end]
+            yield start + pos, start + end, header, timestamp, payload
+            pos = end
+
+    def _file_offsets(self, logf):
+        # record offsets of logf, from the table or by reading the headers
+        if self._offsets is None:
+            return None
+        for i in range(self.keep_logs + 1):
+            if self.logf(i) == logf:
+                break
+        else:
+            return None
+        while len(self._offsets) <= i:
+            self._offsets.append(None)
+        if self._offsets[i] is None:
+            try:
+                with open(logf, "rb") as f:
+                    self._offsets[i] = [x[0] for x in self._records(f)]
+            except nofileerror:
+                return None
+        return self._offsets[i]
+
+    def _decode(self, pos, header, timestamp, payload):
+        if self._raw:
+            if self.timestamp:
+                return varint(header) + varint(timestamp) + payload
+            return varint(header) + payload
+        if not header & 1:
+            payload = payload.decode()
+        if self.timestamp:
+            timestamp = time.localtime(timestamp)
+        elif self.timestamp_interval:
+            timestamp = time.time() - self.read_pos * self.timestamp_interval
+            timestamp = time.localtime(timestamp)
+        return Line(pos, timestamp, payload)
+
+    def _line(self, pos, line):
+        header, end = unpack_varint(line)
+        timestamp = None
+        if self.timestamp:
+            timestamp, end = unpack_varint(line, end)
+        return self._decode(pos, header, timestamp, line[end:])
+
+    def _reader(self, logf, skip, pos=None):
+        if pos is None:
+            pos = self.abs_pos - self._offset
+        offsets = self._file_offsets(logf) if skip else None
+        try:
+            with open(logf, "rb") as f:
+                if offsets is not None:
+                    if skip >= len(offsets):
+                        return
+                    f.seek(offsets[skip])
+                    skip = 0
+                for _, _, header, timestamp, payload in self._records(f):
+                    if skip:
+                        skip -= 1
+                        continue
+                    if self._read >= self._to_read:
+                        break
+                    yield self._decode(pos + self._read, header, timestamp, payload)
+                    self._read += 1
+        except nofileerror:
+            pass
+
+    def _count_lines(self, logf, tail=False):
+        lines, end = 0, 0
+        with open(logf, "rb") as f:
+            for _, end, _, _, _ in self._records(f):
+                lines += 1
+        torn = os.stat(logf)[6] - end
+        if torn and not tail:
+            raise ValueError("{} ends in a partial record".format(logf))
+        return lines, torn
+
+    def _truncate_tail(self, logf):
+        # records can't be framed from the end, so walk the headers of log_0,
+        # which also fills in its offset table.
+        offsets, end = [], 0
+        try:
+            with open(logf, "rb") as f:
+                for offset, end, _, _, _ in self._records(f):
+                    offsets.append(offset)
+            if end < os.stat(logf)[6]:
+                self._truncate(logf, end)
+        except nofileerror:
+            pass
+        self._size = end
+        if self._offsets is not None:
+            self._offsets[:1] = [offsets]
@@ -0,0 +1,48 @@
+try:
+    from time import ticks_us, ticks_diff  # micropython
+except ImportError:
+    from time import perf_counter_ns
+
+    def ticks_us():
+        return perf_counter_ns() // 1000
+
+    def ticks_diff(end, start):
+        return end - start
+
+
+class Metrics:
+    # counters and latency histograms for a RotatingLog.
+    # Histogram bucket i counts calls taking under 2**i us, the last bucket
+    # everything slower.  hook(name, value) is called on every observation.
+    def __init__(self, hook=None, buckets=24):
+        self.hook = hook
+        self.buckets = buckets
+        self.counters = {}
+        self.histograms = {}
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+        if self.hook:
+            self.hook(name, n)
+
+    def observe(self, name, us):
+        try:
+            hist = self.histograms[name]
+        except KeyError:
+            hist = self.histograms[name] = [0] * self.buckets
+        bucket = 0
+        while us >> bucket and bucket < self.buckets - 1:
+            bucket += 1
+        hist[bucket] += 1
+        if self.hook:
+            self.hook(name, us)
+
+    def snapshot(self):
+        return dict(
+            counters=dict(self.counters),
+            histograms={k: list(v) for k, v in self.histograms.items()},
+        )
+
+    def reset(self):
+        self.counters = {}
+        self.histograms = {}
@@ -1,19 +1,122 @@
 import struct
 import math
-from .util import pack_bools, unpack_bools
-from .text import RotatingLog, nofileerror
+from array import array
+from .util import pack_bools, unpack_bools, record_crc
+from .text import RotatingLog, nofileerror, os
 from collections import namedtuple
 import time
 
-Line = namedtuple("line", ("id", "floats", "ints", "bools", "timestamp"))
+Line = namedtuple("Line", ("id", "floats", "ints", "bools", "timestamp"))
+_rows = {}
+
+
+def _row(names):
+    # namedtuples for projected reads, made once per set of columns
+    try:
+        return _rows[names]
+    except KeyError:
+        _rows[names] = namedtuple("Row", ("id",) + names)
+        return _rows[names]
+
+
+# micropython's array has no frombytes()
+_frombytes = hasattr(array("f"), "frombytes")
+
+
+class Block:
+    # many records at once, as flat columns: floats and ints hold
+    # count * floats (ints) values row by row, bools count * bool_bytes packed
+    # bytes and timestamps count values, or None if not stored.
+    __slots__ = ("id", "count", "floats", "ints", "bools", "timestamps")
+
+    def __init__(self, id, count, floats, ints, bools, timestamps):
+        self.id = id
+        self.count = count
+        self.floats = floats
+        self.ints = ints
+        self.bools = bools
+        self.timestamps = timestamps
+
+    def __len__(self):
+        return self.count
+
+
+_ops = {
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+}
+
+
+class FileStats:
+    # running min/max of every struct field in a file, and which bool bits
+    # are set in any/all records.  Fields that have held a NaN have no
+    # usable min/max, so can always match.
+    __slots__ = ("lo", "hi", "any", "all", "nan")
+
+    def __init__(self):
+        self.lo = None
+        self.nan = set()
+
+    def update(self, values, bool_start):
+        if self.lo is None:
+            self.lo = list(values)
+            self.hi = list(values)
+            self.any = list(values[bool_start:])
+            self.all = list(values[bool_start:])
+        lo, hi = self.lo, self.hi
+        for i, x in enumerate(values):
+            if x != x:
+                self.nan.add(i)
+            elif x < lo[i]:
+                lo[i] = x
+            elif x > hi[i]:
+                hi[i] = x
+        for i, x in enumerate(values[bool_start:]):
+            self.any[i] |= x
+            self.all[i] &= x
+
+    def may_match(self, predicate, bool_start):
+        if self.lo is None:
+            return False
+        pos, _, _, mask, op, value = predicate
+        if pos in self.nan:
+            return True
+        if mask:
+            i = pos - bool_start
+            if (op == "==") == bool(value):
+                return bool(self.any[i] & mask)
+            return not self.all[i] & mask
+        lo, hi = self.lo[pos], self.hi[pos]
+        if op == "==":
+            return lo <= value <= hi
+        elif op == "!=":
+            return not lo == hi == value
+        elif op[0] == "<":
+            return _ops[op](lo, value)
+        return _ops[op](hi, value)
 
 
 class PackedRotatingLog(RotatingLog):
-    def __init__(self, name, outdir, floats, ints, bools, **kwargs):
+    _unshipped = RotatingLog._unshipped + ("_stats",)
+
+    def __init__(
+        self, name, outdir, floats, ints, bools, checksum=False, stats=False, **kwargs
+    ):
         self.floats = floats
         self.bools = bools
         self.ints = ints
+        self.checksum = checksum
+        self._projection = None
+        self._where = None
+        # per-file FileStats, indexed like logf(); None where unknown
+        self._stats = [] if stats else None
         super().__init__(name, outdir, ext="bin", **kwargs)
+        if self._stats == []:
+            self._stats.append(None if self.pos else FileStats())
 
     @property
     def bool_bytes(self):
@@ -31,10 +134,18 @@ class PackedRotatingLog(RotatingLog):
     def int_bytes(self):
         return len(struct.pack("i", 12346) * self.ints)
 
+    @property
+    def checksum_bytes(self):
+        return 2 if self.checksum else 0
+
     @property
     def line_size(self):
         return (
-            self.timestamp_bytes + self.bool_bytes + self.float_bytes + self.int_bytes
+            self.timestamp_bytes
+            + self.bool_bytes
+            + self.float_bytes
+            + self.int_bytes
+            + self.checksum_bytes
         )
 
     @property
@@ -45,11 +156,100 @@ class PackedRotatingLog(RotatingLog):
         else:
             return struct
 
+    @property
+    def fields(self):
+        fields = ["float{}".format(i) for i in range(self.floats)]
+        fields += ["int{}".format(i) for i in range(self.ints)]
+        fields += ["bool{}".format(i) for i in range(self.bools)]
+        if self.timestamp:
+            fields.append("timestamp")
+        return tuple(fields)
+
+    def _field_pos(self, field):
+        # (index in struct_string, mask); mask is 0 for numbers and None for
+        # the timestamp.
+        fields = self.fields
+        if not isinstance(field, str):
+            field = fields[field]
+        try:
+            i = fields.index(field)
+        except ValueError:
+            raise ValueError("No such field: {}".format(field))
+        mask = 0
+        numbers = self.floats + self.ints
+        if field == "timestamp":
+            pos, mask = -1, None
+        elif i < numbers:
+            pos = i
+        else:
+            byte, bit = divmod(i - numbers, 8)
+            pos, mask = numbers + byte, 1 << bit
+        if self.timestamp:
+            pos += 1
+        return pos, mask
+
+    def field_layout(self, field):
+        # (offset, format, mask) of a field within a packed record.
+        pos, mask = self._field_pos(field)
+        s = self.struct_string
+        return struct.calcsize(s[:pos]), s[pos], mask
+
+    @property
+    def _bool_start(self):
+        return len(self.struct_string) - self.bool_bytes
+
+    def predicate(self, where):
+        # where is a list of (field, op, value), or bare bool field names
+        # meaning the bool is set.  All must hold.
+        predicate = []
+        for x in where:
+            if isinstance(x, str):
+                x = (x, "==", True)
+            field, op, value = x
+            if op not in _ops:
+                raise ValueError("Unknown operator: {}".format(op))
+            pos, mask = self._field_pos(field)
+            offset, ch = (
+                struct.calcsize(self.struct_string[:pos]),
+                self.struct_string[pos],
+            )
+            if mask and op not in ("==", "!="):
+                raise ValueError("Bools only support == and !=")
+            predicate.append((pos, offset, ch, mask, op, value))
+        return predicate
+
+    def match(self, seg):
+        for _, offset, ch, mask, op, value in self._where:
+            if mask:
+                x = seg[offset] & mask == mask
+            else:
+                x = struct.unpack_from(ch, seg, offset)[0]
+            if not _ops[op](x, value):
+                return False
+        return True
+
+    def projection(self, columns, tuples=False):
+        layout = [self.field_layout(x) for x in columns]
+        # one struct covering only the requested fields, padding over the rest
+        fmt, end, order = "", 0, []
+        for offset, ch, _ in sorted(layout):
+            if (offset, ch) in order:
+                continue
+            if offset > end:
+                fmt += "{}x".format(offset - end)
+            fmt += ch
+            end = offset + struct.calcsize(ch)
+            order.append((offset, ch))
+        index = tuple(order.index((offset, ch)) for offset, ch, _ in layout)
+        masks = tuple(mask for _, _, mask in layout)
+        names = tuple(x if isinstance(x, str) else self.fields[x] for x in columns)
+        return fmt, index, masks, names, tuples
+
     def add_timestamp(self, line):
         # override as we do it in pack() and unpack()
         return line
 
-    def pack(self, floats=None, ints=None, bools=None):
+    def pack(self, floats=None, ints=None, bools=None, timestamp=None):
         if self.bool_bytes:
             bools = [
                 pack_bools(bools[i : min(i + 8, len(bools))])
@@ -59,7 +259,7 @@ class PackedRotatingLog(RotatingLog):
         # micropython only allows one * expansion per line
         args = []
         if self.timestamp:
-            args.append(round(time.time()))
+            args.append(round(time.time() if timestamp is None else timestamp))
         if floats:
             args += floats
         if ints:
@@ -67,8 +267,16 @@ class PackedRotatingLog(RotatingLog):
         if bools:
             args += bools
         packed = struct.pack(self.struct_string, *args)
+        if self.checksum:
+            packed += struct.pack("H", record_crc(packed))
         return packed
 
+    def verify(self, packed):
+        if not self.checksum:
+            return len(packed) == self.line_size
+        crc = struct.unpack("H", packed[-2:])[0]
+        return crc == record_crc(packed[:-2])
+
     def timestampify(self, floats, ints, bools, timestamp):
         if timestamp:
             return floats, ints, bools, time.localtime(timestamp)
@@ -79,6 +287,8 @@ class PackedRotatingLog(RotatingLog):
             return floats, ints, bools, timestamp
 
     def unpack(self, packed):
+        if self.checksum:
+            packed = packed[:-2]
         unpacked = struct.unpack(self.struct_string, packed)
         bools, ints, floats = (), (), ()
         timestamp = None
@@ -96,22 +306,190 @@ class PackedRotatingLog(RotatingLog):
             floats = unpacked[: self.floats]
         return self.timestampify(floats, ints, bools, timestamp)
 
+    def _truncate_tail(self, logf):
+        # drop a partially written record, and the last record if its crc fails
+        try:
+            size = os.stat(logf)[6]
+        except nofileerror:
+            return
+        keep = size - size % self.line_size
+        if keep and self.checksum:
+            with open(logf, "rb") as f:
+                f.seek(keep - self.line_size)
+                if not self.verify(f.read(self.line_size)):
+                    keep -= self.line_size
+        if keep != size:
+            self._truncate(logf, keep)
+
+    def _count_lines(self, logf, tail=False):
+        # cheap layout checks: whole records, and a good crc on the last one
+        size = os.stat(logf)[6]
+        torn = size % self.line_size
+        if torn and not tail:
+            raise ValueError(
+                "{} is {} bytes, not a whole number of {} byte records: "
+                "check floats, ints, bools, timestamp and checksum".format(
+                    logf, size, self.line_size
+                )
+            )
+        size -= torn
+        if self.checksum and size:
+            with open(logf, "rb") as f:
+                f.seek(size - self.line_size)
+                if not self.verify(f.read(self.line_size)):
+                    raise ValueError("{} fails its checksum".format(logf))
+        return size // self.line_size, torn
+
     def rotate_logs(self):
         super().rotate_logs()
         self.pos = 0
+        if self._stats is not None:
+            self._stats.insert(0, FileStats())
+            del self._stats[self.keep_logs + 1 :]
 
     def append(self, **kwargs):
         line = self.pack(**kwargs)
         super().append(line)
+        if self._stats and self._stats[0]:
+            values = struct.unpack(
+                self.struct_string, line[: len(line) - self.checksum_bytes]
+            )
+            self._stats[0].update(values, self._bool_start)
+
+    def _may_match(self, logf):
+        for i, stats in enumerate(self._stats):
+            if stats and self.logf(i) == logf:
+                bool_start = self._bool_start
+                return all(stats.may_match(x, bool_start) for x in self._where)
+        return True
 
     def writeln(self, line):
         with open(self.logf(), "ab") as f:
             f.write(line)
 
+    def _raw_size(self, seg):
+        return len(seg)
+
+    def _wanted(self, seg):
+        return not self._where or self.match(seg)
+
+    def _line(self, pos, seg):
+        if self._raw:
+            return seg
+        if not self._projection:
+            return Line(pos, *self.unpack(seg))
+        fmt, index, masks, names, tuples = self._projection
+        if fmt is None:
+            return (pos,) + self.unpack(seg)
+        values = struct.unpack_from(fmt, seg)
+        row = [pos]
+        for i, mask in zip(index, masks):
+            if mask is None:
+                row.append(time.localtime(values[i]))
+            elif mask:
+                row.append(values[i] & mask == mask)
+            else:
+                row.append(values[i])
+        if tuples:
+            return tuple(row)
+        return _row(names)(*row)
+
+    def read(self, logf=None, n=None, skip=0, columns=None, tuples=False, where=None):
+        if where:
+            self._where = self.predicate(where)
+        if columns:
+            self._projection = self.projection(columns, tuples)
+        elif tuples:
+            self._projection = (None, None, None, None, True)
+        try:
+            yield from super().read(logf=logf, n=n, skip=skip)
+        finally:
+            self._projection = None
+            self._where = None
+
+    def scan(self, where, n=None, skip=0, columns=None, tuples=False):
+        # like read(), but only yields lines matching where; see predicate()
+        return self.read(n=n, skip=skip, columns=columns, tuples=tuples, where=where)
+
+    def _column(self, column, buf, count, fmt, offset, size):
+        # copy one field range out of every record into column
+        if not size:
+            return column
+        line_size = self.line_size
+        if _frombytes:
+            mv = memoryview(buf)
+            for start in range(offset, count * line_size, line_size):
+                column.frombytes(mv[start : start + size])
+        else:
+            for start in range(offset, count * line_size, line_size):
+                column.extend(struct.unpack_from(fmt, buf, start))
+        return column
+
+    def _block(self, pos, buf, count):
+        s = self.struct_string
+        i = 1 if self.timestamp else 0
+        j = i + self.floats
+        k = j + self.ints
+        timestamps = None
+        if self.timestamp:
+            timestamps = self._column(
+                array("l"), buf, count, "l", 0, self.timestamp_bytes
+            )
+        floats = s[i:j]
+        floats = self._column(
+            array("f"), buf, count, floats, struct.calcsize(s[:i]), self.float_bytes
+        )
+        ints = s[j:k]
+        ints = self._column(
+            array("i"), buf, count, ints, struct.calcsize(s[:j]), self.int_bytes
+        )
+        bools = bytearray()
+        if self.bool_bytes:
+            offset = struct.calcsize(s[:k])
+            for start in range(offset, count * self.line_size, self.line_size):
+                bools += buf[start : start + self.bool_bytes]
+        return Block(pos, count, floats, ints, bytes(bools), timestamps)
+
+    def read_blocks(self, n=None, skip=0, block_size=256):
+        # like read(), but yields Blocks of up to block_size records
+        self._to_read = n if n else self.pos
+        self._read = 0
+        if not self._window(skip):
+            return
+        for logf, skip in self._files():
+            yield from self._block_reader(logf, skip, block_size)
+
+    def _block_reader(self, logf, skip, block_size):
+        pos = self.abs_pos - self._offset
+        try:
+            with open(logf, "rb") as f:
+                f.seek(skip * self.line_size)
+                read_in_file = skip
+                while self._read < self._to_read and read_in_file < self.log_lines:
+                    count = min(
+                        block_size,
+                        self._to_read - self._read,
+                        self.log_lines - read_in_file,
+                    )
+                    buf = f.read(count * self.line_size)
+                    count = len(buf) // self.line_size
+                    if not count:
+                        break
+                    yield self._block(pos + self._read, buf, count)
+                    self._read += count
+                    read_in_file += count
+        except nofileerror:
+            pass
+
     def _reader(self, logf, skip, pos=None):
         if pos is None:
             pos = self.abs_pos - self._offset
 
+        if self._where and self._stats and not self._may_match(logf):
+            lines = self.pos if logf == self.logf() else self.log_lines
+            self._read = min(self._to_read, self._read + lines - skip)
+            return
+
         try:
             with open(logf, "rb") as f:
                 f.seek(skip * self.line_size)
@@ -120,7 +498,8 @@ class PackedRotatingLog(RotatingLog):
                     seg = f.read(self.line_size)
                     if not seg:
                         break
-                    yield Line(pos + self._read, *self.unpack(seg))
+                    if self._wanted(seg):
+                        yield self._line(pos + self._read, seg)
                     self._read += 1
                     read_in_file += 1
         except nofileerror:
@@ -10,11 +10,62 @@ except ImportError:
 
 import time
 from collections import namedtuple
+from .metrics import ticks_us, ticks_diff
 
 Line = namedtuple("Line", ("id", "timestamp", "line"))
 
 
+def _map_file(fn, cls, state, logf, pos):
+    # _reader keeps its cursor on the instance, so work on a copy
+    reader = cls.__new__(cls)
+    reader.__dict__.update(state)
+    reader._to_read = reader.log_lines
+    reader._read = 0
+    reader._offset = reader.abs_pos - pos
+    return fn(reader._reader(logf, 0, pos=pos))
+
+
+class Ring:
+    # a list used as a ring buffer, so dropping the oldest item is O(1).
+    # It only grows, by doubling, when full and not bounded by count.
+    __slots__ = ("items", "head", "n")
+
+    def __init__(self, size):
+        self.items = [None] * max(size, 8)
+        self.head = 0
+        self.n = 0
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.n
+        return self.items[(self.head + i) % len(self.items)]
+
+    def __iter__(self):
+        for i in range(self.n):
+            yield self[i]
+
+    def append(self, x):
+        if self.n == len(self.items):
+            self.items = list(self) + [None] * self.n
+            self.head = 0
+        self.items[(self.head + self.n) % len(self.items)] = x
+        self.n += 1
+
+    def popleft(self):
+        x = self.items[self.head]
+        self.items[self.head] = None
+        self.head = (self.head + 1) % len(self.items)
+        self.n -= 1
+        return x
+
+
 class RotatingLog:
+    # state _reader doesn't need, left out of what map_files sends workers
+    _unshipped = ("_cache", "_file_bytes", "_file_times")
+
     def __init__(
         self,
         name,
@@ -25,6 +76,13 @@ class RotatingLog:
         timestamp_interval=None,
         incorporate=True,
         ext="log",
+        cache=0,
+        cache_bytes=0,
+        metrics=None,
+        max_bytes=None,
+        max_age=None,
+        check_interval=100,
+        readonly=False,
     ):
         self.name = name
         self.outdir = outdir
@@ -39,15 +97,110 @@ class RotatingLog:
         self._line_size = 100  # chars in line
         self.timestamp = timestamp
         self.timestamp_interval = timestamp_interval
+        # most recent raw lines, oldest first, capped by count and/or bytes
+        self.cache_lines = cache
+        self.cache_bytes = cache_bytes
+        self._cache = Ring(cache) if cache or cache_bytes else None
+        self._cache_size = 0
+        self._raw = False
+        self.metrics = metrics
+        if metrics:
+            self._instrument()
+        # byte/age retention on top of keep_logs; sizes and last write times
+        # are tracked per file, indexed like logf().
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.check_interval = check_interval
+        self._file_bytes = None
+        self._file_times = None
+        self._bytes = 0
+        self._since_check = 0
+        self._over_budget = False  # log_0 alone is over max_bytes
+        self._first = 0  # abs position of the oldest line still on disk
+        self.readonly = readonly
+        self.torn_tail = 0
+        if readonly:
+            self.load_logs()
+            return
         if incorporate:
             self.incorporate_logs()
         else:
             self.rotate_logs()
+        if max_bytes or max_age:
+            self._scan_files()
 
-        lines_to_full = self.max_lines - self.abs_pos
-        if self.available(outdir) < self.fsize(lines_to_full):
+        needed = self.fsize(self.max_lines - self.abs_pos)
+        if max_bytes:
+            needed = min(needed, max_bytes - self._bytes)
+        if self.available(outdir) < needed:
             raise Exception("Insufficient space in outdir")
 
+    def _instrument(self):
+        # wrap methods on the instance, so there is no cost when disabled
+        metrics = self.metrics
+
+        def timed(fn, name):
+            def wrapper(*args, **kwargs):
+                start = ticks_us()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    metrics.observe(name, ticks_diff(ticks_us(), start))
+
+            return wrapper
+
+        writeln = timed(self.writeln, "writeln_us")
+
+        def counted_writeln(line):
+            writeln(line)
+            metrics.count("appends")
+            metrics.count("bytes_written", self._raw_size(self._stored(line)))
+
+        rotate_logs = timed(self.rotate_logs, "rotate_logs_us")
+
+        def counted_rotate_logs():
+            rotate_logs()
+            metrics.count("rotations")
+
+        read = self.read
+
+        def timed_read(*args, **kwargs):
+            # only time spent in read() counts, not in the caller
+            lines = read(*args, **kwargs)
+            n, us = 0, 0
+            try:
+                while True:
+                    start = ticks_us()
+                    try:
+                        line = next(lines)
+                    except StopIteration:
+                        break
+                    finally:
+                        us += ticks_diff(ticks_us(), start)
+                    n += 1
+                    yield line
+            finally:
+                metrics.count("records_read", n)
+                metrics.observe("read_us", us)
+
+        self.writeln = counted_writeln
+        self.rotate_logs = counted_rotate_logs
+        self.read = timed_read
+        self.incorporate_logs = timed(self.incorporate_logs, "incorporate_logs_us")
+
+    def __getstate__(self):
+        # the instrumented methods are closures, which don't pickle
+        state = self.__dict__.copy()
+        for name in ("writeln", "rotate_logs", "read", "incorporate_logs"):
+            state.pop(name, None)
+        state["metrics"] = None
+        return state
+
+    def _removed(self, logf):
+        os.remove(logf)
+        if self.metrics:
+            self.metrics.count("files_removed")
+
     @staticmethod
     def available(d):
         stat = os.statvfs(d)
@@ -89,11 +242,111 @@ class RotatingLog:
             return line
 
     def append(self, line):
+        if self.readonly:
+            raise OSError("{} is open read-only".format(self.outdir))
         line = self.add_timestamp(line)
         if self.pos == self.log_lines:
             self.rotate_logs()
         self.writeln(line)
         self.pos += 1
+        if self._cache is not None or self._file_bytes is not None:
+            line = self._stored(line)
+            if self._cache is not None:
+                self._cache_push(line)
+            if self._file_bytes is not None:
+                self._account(self._raw_size(line))
+
+    def _account(self, size):
+        self._file_bytes[0] += size
+        self._bytes += size
+        if self.max_bytes and self._bytes > self.max_bytes and not self._over_budget:
+            self._enforce_retention()
+        self._since_check += 1
+        if self._since_check >= self.check_interval:
+            self._since_check = 0
+            self._enforce_retention(check_space=True)
+
+    def _scan_files(self):
+        # one stat per file at startup; appends are counted from then on
+        logs = self.logs_in_outdir()
+        n = max(logs) + 1 if logs else 1
+        self._file_bytes = [0] * n
+        self._file_times = [None] * n
+        for i in logs:
+            stat = os.stat(self.logf(i))
+            self._file_bytes[i] = stat[6]
+            self._file_times[i] = stat[8]
+        self._bytes = sum(self._file_bytes)
+        self._enforce_retention()
+
+    def _evict(self):
+        # remove the oldest file, but never log_0
+        logs = self.logs_in_outdir()
+        oldest = max(logs) if logs else 0
+        if not oldest:
+            return False
+        self._removed(self.logf(oldest))
+        first = self.abs_pos - self.pos - (oldest - 1) * self.log_lines
+        self._first = max(self._first, first)
+        del self._file_bytes[oldest:]
+        del self._file_times[oldest:]
+        self._bytes = sum(self._file_bytes)
+        if self._cache:
+            self._trim_cache(self.abs_pos - self._first)
+        return True
+
+    def _enforce_retention(self, check_space=False):
+        if self.max_bytes:
+            while self._bytes > self.max_bytes:
+                if not self._evict():
+                    # log_0 is never evicted, so wait for it to rotate
+                    self._over_budget = True
+                    if self.metrics:
+                        self.metrics.count("over_budget")
+                    break
+        if self.max_age:
+            cutoff = time.time() - self.max_age
+            times = self._file_times
+            # None is an unknown time, which is never evicted
+            while len(times) > 1 and (times[-1] or cutoff) < cutoff:
+                if not self._evict():
+                    break
+        if check_space and self.available(self.outdir) < self.fsize(self.log_lines):
+            self._evict()
+
+    def _stored(self, line):
+        # line as writeln() puts it on disk, less the newline
+        return line[: self.line_size]
+
+    def _raw_size(self, line):
+        # bytes on disk, counting the newline
+        return len(line.encode()) + 1
+
+    def _cache_push(self, line):
+        cache = self._cache
+        if self.cache_lines and len(cache) == self.cache_lines:
+            self._cache_size -= self._raw_size(cache.popleft())
+        cache.append(line)
+        self._cache_size += self._raw_size(line)
+        if self.cache_bytes:
+            self._trim_cache(len(cache))
+
+    def _trim_cache(self, lines):
+        cache = self._cache
+        while len(cache) > lines or (
+            cache and self.cache_bytes and self._cache_size > self.cache_bytes
+        ):
+            self._cache_size -= self._raw_size(cache.popleft())
+
+    def _fill_cache(self):
+        # read back the tail of the log, without decoding
+        n = min(self.abs_pos, self.cache_lines or self.cache_bytes)
+        self._raw = True
+        try:
+            for line in self._read_unmetered(n=n):
+                self._cache_push(line)
+        finally:
+            self._raw = False
 
     def timestampify(self, line):
         if self.timestamp:
@@ -113,6 +366,15 @@ class RotatingLog:
         else:
             return (line, None)
 
+    def _line(self, pos, line):
+        if self._raw:
+            return line
+        line, timestamp = self.timestampify(line)
+        return Line(pos, timestamp, line)
+
+    def _wanted(self, line):
+        return True
+
     def _reader(self, logf, skip, pos=None):
         if pos is None:
             pos = self.abs_pos - self._offset
@@ -124,12 +386,21 @@ class RotatingLog:
                     x = f.readline()
                     if not x:
                         break
-                    line, timestamp = self.timestampify(x[:-1])
-                    yield Line(pos + self._read, timestamp, line)
+                    yield self._line(pos + self._read, x[:-1])
                     self._read += 1
         except nofileerror:
             pass
 
+    def _cache_reader(self):
+        pos = self.abs_pos - self._offset
+        cache = self._cache
+        start = len(cache) - self._offset
+        for i in range(start, start + self._to_read):
+            line = cache[i]
+            if self._wanted(line):
+                yield self._line(pos + self._read, line)
+            self._read += 1
+
     def read(self, logf=None, n=None, skip=0):
         self._to_read = n if n else self.pos
         self._read = 0
@@ -137,13 +408,35 @@ class RotatingLog:
             yield from self._reader(logf, skip, pos=0)
             return
 
+        if not self._window(skip):
+            return
+
+        if self._cache and self._offset <= len(self._cache):
+            yield from self._cache_reader()
+            return
+
+        for logf, skip in self._files():
+            yield from self._reader(logf, skip)
+
+    def _read_unmetered(self, **kwargs):
+        # read() as the class defines it, bypassing any metrics wrapper, so
+        # reads the log does for itself don't count as records_read
+        return type(self).read(self, **kwargs)
+
+    def _window(self, skip):
+        # point _offset at the first line to read, clamping _to_read to what
+        # is retained.  False if there is nothing to read.
         self._offset = skip + self._to_read
-        if self._offset > self.abs_pos:
-            self._to_read -= self._offset - self.abs_pos
+        retained = self.abs_pos - self._first
+        if self._offset > retained:
+            self._to_read -= self._offset - retained
             if self._to_read <= 0:
-                return
+                return False
             self._offset = skip + self._to_read
+        return True
 
+    def _files(self):
+        # (logf, lines to skip in it) covering the window, oldest first
         fs, skip = divmod(self._offset - self.pos, self.log_lines)
         if fs >= 0:
             fs += 1
@@ -151,27 +444,65 @@ class RotatingLog:
         fs = max(fs, 0)
         if fs:
             for i in range(fs, -1, -1):
-                yield from self._reader(self.logf(i), skip)
+                yield self.logf(i), skip
                 skip = 0
         else:
-            skip = self.pos - self._offset
-            yield from self._reader(self.logf(), skip)
+            yield self.logf(), self.pos - self._offset
+
+    def map_files(self, fn, workers=None, threads=False):
+        # yields fn(lines) for each file, oldest first.
+        # fn must be picklable unless threads is set.
+        # concurrent.futures is not available on micropython
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+        logs = sorted(self.logs_in_outdir(), reverse=True)
+        start = self.abs_pos - self.pos
+        state = self.__getstate__()
+        for name in self._unshipped:
+            state[name] = None
+        workers = workers or os.cpu_count() or 1
+        executor = ThreadPoolExecutor if threads else ProcessPoolExecutor
+        with executor(max_workers=workers) as pool:
+            # at most 2 files per worker in flight, so a slow consumer doesn't
+            # end up holding the whole history
+            pending = []
+            for i in logs:
+                pending.append(
+                    pool.submit(
+                        _map_file,
+                        fn,
+                        self.__class__,
+                        state,
+                        self.logf(i),
+                        start - i * self.log_lines,
+                    )
+                )
+                if len(pending) >= 2 * workers:
+                    yield pending.pop(0).result()
+            while pending:
+                yield pending.pop(0).result()
+
+    def read_parallel(self, workers=None, threads=False):
+        for lines in self.map_files(list, workers=workers, threads=threads):
+            yield from lines
 
     def logs_in_outdir(self):
         # warning: this is quite flaky
         # uPy has no glob
         logs = []
         for fn in os.listdir(self.outdir):
-            if fn.startswith(self.name):
+            if fn.startswith(self.name) and fn.endswith(".{}".format(self.ext)):
                 logs.append(int(fn.split("_")[-1].replace(".{}".format(self.ext), "")))
         return logs
 
     def rotate_logs(self):
+        if self.readonly:
+            raise OSError("{} is open read-only".format(self.outdir))
         if self.keep_logs:
             logs = self.logs_in_outdir()
             if 0 in logs:
                 for i in (x for x in logs if x > self.keep_logs - 1):
-                    os.remove(self.logf(i))
+                    self._removed(self.logf(i))
                 for i in sorted(
                     (x for x in logs if x <= self.keep_logs - 1), reverse=True
                 ):
@@ -179,28 +510,143 @@ class RotatingLog:
 
         else:
             try:
-                os.remove(self.logf())
+                self._removed(self.logf())
             except Exception:
                 pass
         self._abs_pos += self.pos
         self.pos = 0
+        if self._cache:
+            # forget anything no longer on disk
+            self._trim_cache(self.keep_logs * self.log_lines)
+        if self._file_bytes is not None:
+            self._file_times[0] = time.time() if self.max_age else None
+            self._file_bytes.insert(0, 0)
+            self._file_times.insert(0, None)
+            del self._file_bytes[self.keep_logs + 1 :]
+            del self._file_times[self.keep_logs + 1 :]
+            self._bytes = sum(self._file_bytes)
+            self._over_budget = False
+            self._enforce_retention()
+
+    @staticmethod
+    def _truncate(logf, size):
+        with open(logf, "r+b") as f:
+            try:
+                f.truncate(size)
+                return
+            except AttributeError:  # pragma: no cover
+                pass
+
+        # micropython has no truncate(): copy the good part over
+        tmp = "{}.tmp".format(logf)
+        with open(logf, "rb") as src, open(tmp, "wb") as dst:
+            while size:
+                chunk = src.read(min(size, 512))
+                if not chunk:
+                    break
+                dst.write(chunk)
+                size -= len(chunk)
+        os.remove(logf)
+        os.rename(tmp, logf)
+
+    def _truncate_tail(self, logf):
+        # drop a partially written last line
+        try:
+            size = os.stat(logf)[6]
+        except nofileerror:
+            return
+        if not size:
+            return
+        chunk = min(size, 4 * (self.line_size + 1))
+        with open(logf, "rb") as f:
+            f.seek(size - chunk)
+            tail = f.read(chunk)
+        if tail.endswith(b"\n"):
+            return
+        end = tail.rfind(b"\n") + 1
+        if end or chunk == size:
+            self._truncate(logf, size - chunk + end)
+
+    def _finish_rotation(self, logs):
+        # rotate_logs renames from the top down, so a crash leaves a gap
+        # above 0: shift everything below it up to complete the rotation.
+        if 0 not in logs:
+            return
+        logs = sorted(logs)
+        for gap, i in enumerate(logs):
+            if gap != i:
+                break
+        else:
+            return
+        for i in range(gap - 1, -1, -1):
+            os.rename(self.logf(i), self.logf(i + 1))
+
+    def recover(self):
+        # only looks at the tail of log_0, as it is the only file written to
+        self._finish_rotation(self.logs_in_outdir())
+        self._truncate_tail(self.logf())
+
+    def _count_lines(self, logf, tail=False):
+        # (whole lines, bytes after them); only a tail may be partial
+        lines, size, end = 0, 0, 0
+        with open(logf, "rb") as f:
+            while True:
+                chunk = f.read(4096)
+                if not chunk:
+                    break
+                n = chunk.count(b"\n")
+                if n:
+                    lines += n
+                    end = size + chunk.rfind(b"\n") + 1
+                size += len(chunk)
+        if size > end and not tail:
+            raise ValueError("{} ends in a partial line".format(logf))
+        return lines, size - end
+
+    def load_logs(self):
+        # pick up the logs in outdir without writing anything, refusing logs
+        # which don't match log_lines or the record layout.  A partial line
+        # or record at the end of log_0 is left out, and its size kept in
+        # torn_tail.
+        logs = sorted(self.logs_in_outdir())
+        if not logs:
+            return
+        if logs[0] > 1 or logs != list(range(logs[0], logs[-1] + 1)):
+            raise ValueError(
+                "{}: logs {} are not consecutive, "
+                "was a rotation interrupted?".format(self.outdir, logs)
+            )
+        for i in logs:
+            lines, torn = self._count_lines(self.logf(i), tail=not i)
+            if lines > self.log_lines or (i and lines != self.log_lines):
+                raise ValueError(
+                    "{} has {} lines, but log_lines is {}".format(
+                        self.logf(i), lines, self.log_lines
+                    )
+                )
+            if i:
+                self._abs_pos += lines
+            else:
+                self.pos = lines
+                self.torn_tail = torn
 
     def incorporate_logs(self):
         # incorporate anything else in the outdir
+        self.recover()
         logs = self.logs_in_outdir()
         if not logs:
             return
 
         count = 0
 
-        for line in self.read(logf=self.logf(0), n=self.log_lines):
+        for line in self._read_unmetered(logf=self.logf(0), n=self.log_lines):
             count += 1
         if count < self.log_lines:
             self.pos += count
         else:
             self.rotate_logs()
 
-        logs = self.logs_in_outdir()
+        logs = sorted(self.logs_in_outdir())
         try:
             logs.remove(0)
         except ValueError:
@@ -208,8 +654,13 @@ class RotatingLog:
 
         max_lines = self.max_lines
         for i in logs:
-            flen = len([1 for l in self.read(logf=self.logf(i), n=self.log_lines)])
+            flen = sum(
+                1 for _ in self._read_unmetered(logf=self.logf(i), n=self.log_lines)
+            )
             if self.abs_pos + flen <= max_lines:
                 self._abs_pos += flen
             else:
-                os.unlink(self.logf(i))
+                self._removed(self.logf(i))
+
+        if self._cache is not None:
+            self._fill_cache()
@@ -1,3 +1,9 @@
+try:
+    from binascii import crc32
+except ImportError:  # pragma: no cover
+    from ubinascii import crc32
+
+
 def pack_bools(bools):
     bool_byte = 0
     for i, x in enumerate(bools):
@@ -11,3 +17,30 @@ def unpack_bools(bool_byte):
         mask = 1 << bit
         bools.append((bool_byte & mask) == mask)
     return bools
+
+
+def record_crc(data):
+    # 16 bits is plenty to spot a torn record
+    return crc32(data) & 0xFFFF
+
+
+def varint(n):
+    # unsigned LEB128
+    out = bytearray()
+    while n > 0x7F:
+        out.append(n & 0x7F | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def unpack_varint(buf, pos=0):
+    # returns (value, position after it); IndexError if buf ends mid-varint
+    n = shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        n |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return n, pos
+        shift += 7
@@ -0,0 +1,130 @@
+from packing.binary import BinaryRotatingLog
+from packing.text import Line
+import pytest
+import time
+
+
+def payload(i):
+    if i % 3 == 0:
+        return bytes(range(i % 256)) * 3
+    if i % 3 == 1:
+        return f"line #{i}\nwith a newline"
+    return "x" * (i * 500)  # spans read chunks
+
+
+@pytest.fixture(params=[True, False], ids=["offsets", "no-offsets"])
+def log(request, tmp_path):
+    l = BinaryRotatingLog(
+        "log", str(tmp_path), log_lines=10, keep_logs=2, offsets=request.param
+    )
+    yield l, tmp_path
+
+
+def test_append_record(log):
+    log, outdir = log
+    log.append("é#")
+    log.append(b"\x00\n")
+    assert (outdir / "log_0.rec").read_bytes() == b"\x06\xc3\xa9#\x05\x00\n"
+
+
+def test_append_timestamp(mocker, log):
+    log, outdir = log
+    log.timestamp = True
+    mocked_time = mocker.patch("time.time")
+    mocked_time.return_value = 1630322465.354646
+    log.append("a")
+    assert (outdir / "log_0.rec").read_bytes() == b"\x02\xa1\xfe\xb2\x89\x06a"
+    assert list(log.read()) == [Line(0, time.localtime(1630322465), "a")]
+
+
+regions = [(2, 0), (2, 2), (5, 5), (4, 10), (17, 0), (15, 1), (20, 3)]
+
+
+@pytest.mark.parametrize("n,skip", regions)
+def test_read_regions(n, skip, log):
+    log, outdir = log
+    exp = []
+    for i in range(27):
+        log.append(payload(i))
+        exp.append(Line(i, None, payload(i)))
+
+    resp = list(log.read(n=n, skip=skip))
+    assert resp == exp[len(exp) - n - skip : len(exp) - skip]
+
+
+def test_read_fake_timestamp(mocker, log):
+    log, outdir = log
+    log.timestamp_interval = 60
+    mocked_time = mocker.patch("time.time")
+    mocked_time.return_value = 1630322465
+    for i in range(10):
+        log.append(payload(i))
+    resp = list(log.read())
+    assert [x.timestamp for x in resp] == [
+        time.localtime(1630322465 - 600 + i * 60) for i in range(10)
+    ]
+
+
+def test_incorporate(log):
+    log, outdir = log
+    offsets = log._offsets is not None
+    exp = []
+    for i in range(25):
+        log.append(payload(i))
+        exp.append(Line(i, None, payload(i)))
+
+    log = BinaryRotatingLog(
+        "log", str(outdir), log_lines=10, keep_logs=2, offsets=offsets
+    )
+    assert log.pos == 5
+    log.append("new")
+    exp.append(Line(25, None, "new"))
+    assert list(log.read(n=26)) == exp
+    assert list(log.read(n=3, skip=14)) == exp[9:12]
+
+
+@pytest.mark.parametrize("torn", [1, 2, 40])
+def test_recover_torn_record(torn, log):
+    log, outdir = log
+    offsets = log._offsets is not None
+    for i in range(5):
+        log.append(payload(i))
+    with (outdir / "log_0.rec").open("ab") as f:
+        f.write(log.add_timestamp("x" * 1000)[:torn])
+
+    log = BinaryRotatingLog(
+        "log", str(outdir), log_lines=10, keep_logs=2, offsets=offsets
+    )
+    assert log.pos == 5
+    log.append("new")
+    assert [x.line for x in log.read()] == [payload(i) for i in range(5)] + ["new"]
+
+
+def test_cache(tmp_path):
+    log = BinaryRotatingLog("log", str(tmp_path), log_lines=10, cache=5)
+    exp = []
+    for i in range(17):
+        log.append(payload(i))
+        exp.append(Line(i, None, payload(i)))
+    assert log._cache_size == sum(len(x) for x in log._cache)
+    assert list(log.read(n=4)) == exp[-4:]
+
+    log = BinaryRotatingLog("log", str(tmp_path), log_lines=10, cache=5)
+    assert list(log.read(n=4, skip=1)) == exp[-5:-1]
+
+
+def test_readonly(tmp_path):
+    log = BinaryRotatingLog("log", str(tmp_path), log_lines=10)
+    for i in range(15):
+        log.append(payload(i))
+    log = BinaryRotatingLog("log", str(tmp_path), log_lines=10, readonly=True)
+    assert log.abs_pos == 15
+    with open(log.logf(), "ab") as f:
+        f.write(b"\x20abc")
+    log = BinaryRotatingLog("log", str(tmp_path), log_lines=10, readonly=True)
+    assert (log.abs_pos, log.torn_tail) == (15, 4)
+    assert [x.line for x in log.read(n=15)] == [payload(i) for i in range(15)]
+    with open(log.logf(1), "ab") as f:
+        f.write(b"\x20abc")
+    with pytest.raises(ValueError, match="log_1.rec ends in a partial record"):
+        BinaryRotatingLog("log", str(tmp_path), log_lines=10, readonly=True)
@@ -0,0 +1,202 @@
+from packing.__main__ import main
+from packing.packed import PackedRotatingLog
+from packing.text import RotatingLog
+from array import array
+import json
+import subprocess
+import sys
+import pytest
+
+
+@pytest.fixture
+def packed_dir(tmp_path):
+    outdir = tmp_path / "packed"
+    outdir.mkdir()
+    p = PackedRotatingLog("log", str(outdir), 2, 2, 3, log_lines=10, keep_logs=3)
+    for i in range(35):
+        p.append(floats=[i, i / 2], ints=[i, -i], bools=[i % 2, i % 3 == 0, True])
+    yield outdir
+
+
+args = ["--packed", "2", "2", "3", "--log-lines", "10"]
+
+
+def test_export_csv(packed_dir, capsys):
+    main(["export", str(packed_dir), *args])
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == "id,timestamp,float0,float1,int0,int1,bool0,bool1,bool2"
+    assert len(lines) == 36
+    assert lines[-1] == "34,,34.0,17.0,34,-34,False,False,True"
+
+
+def test_export_ndjson(packed_dir, tmp_path):
+    out = tmp_path / "out.ndjson"
+    main(["export", str(packed_dir), *args, "--format", "ndjson", "-o", str(out)])
+    records = [json.loads(x) for x in out.read_text().splitlines()]
+    assert [x["id"] for x in records] == list(range(35))
+    assert records[3] == dict(
+        id=3,
+        timestamp=None,
+        floats=[3.0, 1.5],
+        ints=[3, -3],
+        bools=[True, True, True],
+    )
+
+
+def test_export_raw(packed_dir, tmp_path):
+    prefix = tmp_path / "raw"
+    main(["export", str(packed_dir), *args, "--format", "raw", "-o", str(prefix)])
+    meta = json.loads((tmp_path / "raw.json").read_text())
+    assert meta["count"] == 35
+    assert meta["first_id"] == 0
+    floats = array("f", (tmp_path / "raw.floats").read_bytes())
+    assert list(floats[::2]) == list(range(35))
+    ints = array("i", (tmp_path / "raw.ints").read_bytes())
+    assert list(ints[1::2]) == [-i for i in range(35)]
+    assert len((tmp_path / "raw.bools").read_bytes()) == 35
+
+
+def test_export_raw_text(tmp_path):
+    RotatingLog("log", str(tmp_path)).append("line")
+    with pytest.raises(SystemExit, match="packed"):
+        main(["export", str(tmp_path), "--format", "raw", "-o", str(tmp_path / "x")])
+
+
+def test_convert_packed(packed_dir, tmp_path, equal):
+    dest = tmp_path / "dest"
+    out = main(
+        ["convert", str(packed_dir), str(dest), *args, "--to-packed", "1", "3", "8"]
+        + ["--to-log-lines", "7", "--to-timestamp"]
+    )
+    # 35 records fill log_0 exactly, which must survive reopening
+    log = PackedRotatingLog(
+        "log", str(dest), 1, 3, 8, log_lines=7, keep_logs=out.keep_logs, timestamp=True
+    )
+    assert log.abs_pos == 35
+    exp = [
+        (i, (i,), (i, -i, 0), (bool(i % 2), i % 3 == 0, True) + (False,) * 5)
+        for i in range(35)
+    ]
+    assert equal(exp, list(log.read(n=35)))
+
+    with pytest.raises(SystemExit, match="already has logs"):
+        main(
+            ["convert", str(packed_dir), str(dest), *args, "--to-packed", "1", "1", "1"]
+        )
+
+
+def test_convert_text(tmp_path, equal):
+    src = tmp_path / "src"
+    src.mkdir()
+    log = RotatingLog("log", str(src), log_lines=10, keep_logs=2)
+    for i in range(25):
+        log.append(f"{i}.5,{i},{i % 2},1")
+    dest = tmp_path / "dest"
+    main(
+        ["convert", str(src), str(dest), "--log-lines", "10", "--to-packed", "1", "1"]
+        + ["2", "--to-log-lines", "10", "--to-keep-logs", "1"]
+    )
+    log = PackedRotatingLog("log", str(dest), 1, 1, 2, log_lines=10, keep_logs=2)
+    exp = [
+        (i - 5, (i + 0.5,), (i,), (bool(i % 2), True) + (False,) * 6)
+        for i in range(5, 25)
+    ]
+    assert equal(exp, list(log.read(n=25)))
+
+
+def snapshot(outdir):
+    return {x.name: x.read_bytes() for x in outdir.iterdir()}
+
+
+@pytest.mark.parametrize("records", [30, 35])
+def test_source_unchanged(tmp_path, records):
+    src = tmp_path / "src"
+    src.mkdir()
+    p = PackedRotatingLog("log", str(src), 2, 2, 3, log_lines=10, keep_logs=3)
+    for i in range(records):
+        p.append(floats=[i, i / 2], ints=[i, -i], bools=[i % 2, i % 3 == 0, True])
+    before = snapshot(src)
+    main(["export", str(src), *args, "-o", str(tmp_path / "out.csv")])
+    main(["export", str(src), *args, "--format", "raw", "-o", str(tmp_path / "r")])
+    assert snapshot(src) == before
+    main(
+        [
+            "convert",
+            str(src),
+            str(tmp_path / "dest"),
+            *args,
+            "--to-packed",
+            "1",
+            "1",
+            "1",
+        ]
+    )
+    assert snapshot(src) == before
+    assert len((tmp_path / "out.csv").read_text().splitlines()) == records + 1
+
+
+def test_layout_mismatch(packed_dir, tmp_path):
+    before = snapshot(packed_dir)
+    with pytest.raises(SystemExit, match="has 10 lines, but log_lines is 100"):
+        main(["export", str(packed_dir), "--packed", "2", "2", "3"])
+    with pytest.raises(SystemExit, match="log_0.bin fails its checksum"):
+        main(["export", str(packed_dir), *args, "--checksum"])
+    with pytest.raises(SystemExit, match="whole number"):
+        main(
+            ["export", str(packed_dir), "--packed", "2", "2", "9", "--log-lines", "10"]
+        )
+    assert snapshot(packed_dir) == before
+
+
+def test_torn_tail(tmp_path, capsys):
+    log = RotatingLog("log", str(tmp_path), log_lines=10)
+    log.append("line")
+    with open(log.logf(), "a") as f:
+        f.write("partial")
+    main(["export", str(tmp_path), "--log-lines", "10"])
+    out = capsys.readouterr()
+    assert out.out.splitlines() == ["id,timestamp,line", "0,,line"]
+    assert "partial record of 7 bytes" in out.err
+    assert (tmp_path / "log_0.log").read_text() == "line\npartial"
+
+
+def test_torn_packed_tail(packed_dir, tmp_path, capsys):
+    with open(packed_dir / "log_0.bin", "ab") as f:
+        f.write(b"\x00" * 5)
+    before = snapshot(packed_dir)
+    main(["export", str(packed_dir), *args])
+    out = capsys.readouterr()
+    assert len(out.out.splitlines()) == 36
+    assert "partial record of 5 bytes" in out.err
+    with open(packed_dir / "log_1.bin", "ab") as f:
+        f.write(b"\x00" * 5)
+    with pytest.raises(SystemExit, match="log_1.bin is 175 bytes"):
+        main(["export", str(packed_dir), *args])
+    before["log_1.bin"] += b"\x00" * 5
+    assert snapshot(packed_dir) == before
+
+
+def test_convert_text_error(tmp_path):
+    src = tmp_path / "src"
+    src.mkdir()
+    log = RotatingLog("log", str(src), log_lines=10, keep_logs=2)
+    for i in range(25):
+        log.append("oops" if i == 7 else f"{i}.5,{i}")
+    with pytest.raises(SystemExit, match="log_2.log: line 7: could not convert"):
+        main(
+            ["convert", str(src), str(tmp_path / "dest"), "--log-lines", "10"]
+            + ["--to-packed", "1", "1", "0"]
+        )
+
+
+def test_broken_pipe(tmp_path):
+    log = RotatingLog("log", str(tmp_path), log_lines=1000, keep_logs=9)
+    for i in range(10000):
+        log.append("x" * 90)
+    cmd = [sys.executable, "-m", "packing", "export", str(tmp_path)]
+    cmd += ["--log-lines", "1000"]
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    p.stdout.readline()
+    p.stdout.close()
+    assert p.wait() == 1
+    assert p.stderr.read() == b""
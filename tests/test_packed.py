@@ -1,6 +1,9 @@
-from packing.packed import PackedRotatingLog
+from packing.packed import PackedRotatingLog, Line
 from devtools import debug
 import pytest
+import struct
+from array import array
+from packing.util import unpack_bools
 import time
 
 
@@ -204,3 +207,296 @@ def test_incorporate(packer, equal):
     exp.append([i + 1, floats, floats, bools])
     resp = list(packer.read(n=26))
     assert equal(exp, resp)
+
+
+@pytest.mark.parametrize("threads", [True, False])
+def test_read_parallel(threads, packer, equal):
+    packer, tmp_path = packer
+    packer.keep_logs = 2
+    exp = []
+    for i in range(25):
+        floats, bools = [i, i + 1], [True if i % 2 else False] * 8
+        packer.append(floats=floats, bools=bools, ints=floats)
+        exp.append([i, floats, floats, bools])
+
+    resp = list(packer.read_parallel(workers=2, threads=threads))
+    assert equal(exp, resp)
+
+
+def test_pack_unpack_checksum(packer, equal):
+    packer, tmp_path = packer
+    packer.checksum = True
+    exp = [[1, [45, 76.9], [123478, 123498], [True, False] * 4]]
+    packed = packer.pack(*exp[0][1:])
+    assert len(packed) == packer.line_size
+    assert packer.verify(packed)
+    assert not packer.verify(packed[:-3] + b"\x00" + packed[-2:])
+    assert equal(exp, [[1, *packer.unpack(packed)]])
+
+
+@pytest.mark.parametrize("checksum", [True, False])
+def test_recover_torn_record(checksum, tmp_path, equal):
+    packer = PackedRotatingLog(
+        "log", str(tmp_path), 2, 2, 8, log_lines=10, checksum=checksum
+    )
+    exp = []
+    for i in range(5):
+        floats, bools = [i, i + 1], [True if i % 2 else False] * 8
+        packer.append(floats=floats, bools=bools, ints=floats)
+        exp.append([i, floats, floats, bools])
+    with (tmp_path / "log_0.bin").open("ab") as f:
+        f.write(packer.pack(floats, floats, bools)[:5])
+
+    packer = PackedRotatingLog(
+        "log", str(tmp_path), 2, 2, 8, log_lines=10, checksum=checksum
+    )
+    assert packer.pos == 5
+    assert equal(exp, list(packer.read()))
+
+
+def test_recover_corrupt_record(tmp_path, equal):
+    packer = PackedRotatingLog(
+        "log", str(tmp_path), 2, 2, 8, log_lines=10, checksum=True
+    )
+    exp = []
+    for i in range(5):
+        floats, bools = [i, i + 1], [True if i % 2 else False] * 8
+        packer.append(floats=floats, bools=bools, ints=floats)
+        exp.append([i, floats, floats, bools])
+    with (tmp_path / "log_0.bin").open("ab") as f:
+        f.write(b"\xff" * packer.line_size)
+
+    packer = PackedRotatingLog(
+        "log", str(tmp_path), 2, 2, 8, log_lines=10, checksum=True
+    )
+    assert packer.pos == 5
+    assert equal(exp, list(packer.read()))
+
+
+def test_fields(packer):
+    packer, tmp_path = packer
+    packer.bools = 3
+    assert packer.fields == (
+        "float0",
+        "float1",
+        "int0",
+        "int1",
+        "bool0",
+        "bool1",
+        "bool2",
+    )
+    packer.timestamp = True
+    assert packer.fields[-1] == "timestamp"
+    with pytest.raises(ValueError, match="No such field"):
+        packer.field_layout("bool3")
+
+
+@pytest.mark.parametrize("timestamp", [True, False])
+def test_read_columns(timestamp, packer, mocker):
+    packer, tmp_path = packer
+    packer.timestamp = timestamp
+    mocker.patch("time.time", side_effect=seq())
+    for i in range(17):
+        floats, bools = [i + 0.5, i + 1], [i % 2, i % 3 == 0] + [True] * 6
+        packer.append(floats=floats, bools=bools, ints=[i, -i])
+
+    full = list(packer.read(n=12, skip=2))
+    resp = list(packer.read(n=12, skip=2, columns=("float0", "bool1", 3, "bool0")))
+    assert len(resp) == len(full)
+    for row, line in zip(resp, full):
+        assert row == (
+            line.id,
+            line.floats[0],
+            line.bools[1],
+            line.ints[1],
+            line.bools[0],
+        )
+        assert row.float0 == line.floats[0]
+        assert row.int1 == line.ints[1]
+
+    if timestamp:
+        resp = list(packer.read(n=12, skip=2, columns=("timestamp",)))
+        assert [x.timestamp for x in resp] == [x.timestamp for x in full]
+
+
+def test_read_tuples(packer):
+    packer, tmp_path = packer
+    for i in range(17):
+        floats, bools = [i, i + 1], [True if i % 2 else False] * 8
+        packer.append(floats=floats, bools=bools, ints=floats)
+
+    full = list(packer.read(n=5))
+    resp = list(packer.read(n=5, tuples=True))
+    assert resp == [tuple(x) for x in full]
+    assert not any(isinstance(x, Line) for x in resp)
+    resp = list(packer.read(n=5, columns=("int0",), tuples=True))
+    assert resp == [(x.id, x.ints[0]) for x in full]
+    assert type(resp[0]) is tuple
+    assert list(packer.read(n=5)) == full
+
+
+def fill(packer, lines=27):
+    exp = []
+    for i in range(lines):
+        floats, bools = [i / 2, -i], [i % 2, i % 3 == 0] + [False] * 6
+        packer.append(floats=floats, bools=bools, ints=[i, 7])
+        exp.append(list(packer.read(n=1))[0])
+    return exp
+
+
+wheres = [
+    ["bool0"],
+    [("bool1", "==", False)],
+    [("bool1", "!=", False), ("float0", ">", 3)],
+    [("float1", "<=", -20)],
+    [("int0", "==", 4)],
+    [("int1", "!=", 7)],
+    [("int0", "<", 3), "bool0"],
+    [("float0", ">=", 100)],
+]
+
+
+@pytest.mark.parametrize("stats", [True, False])
+@pytest.mark.parametrize("where", wheres)
+def test_scan(where, stats, tmp_path):
+    packer = PackedRotatingLog(
+        "log", str(tmp_path), 2, 2, 8, log_lines=10, keep_logs=2, stats=stats
+    )
+    exp = fill(packer)
+
+    def matches(line):
+        for x in where:
+            if isinstance(x, str):
+                x = (x, "==", True)
+            field, op, value = x
+            kind, i = field[:-1], int(field[-1])
+            got = getattr(line, kind + "s")[i]
+            if not {
+                "==": got == value,
+                "!=": got != value,
+                "<": got < value,
+                "<=": got <= value,
+                ">": got > value,
+                ">=": got >= value,
+            }[op]:
+                return False
+        return True
+
+    assert list(packer.scan(where, n=27)) == [x for x in exp if matches(x)]
+    assert list(packer.scan(where, n=12, skip=3)) == [
+        x for x in exp[-15:-3] if matches(x)
+    ]
+
+
+def test_scan_skips_files(mocker, tmp_path):
+    packer = PackedRotatingLog(
+        "log", str(tmp_path), 2, 2, 8, log_lines=10, keep_logs=2, stats=True
+    )
+    fill(packer)
+    unpack_from = mocker.spy(struct, "unpack_from")
+    resp = list(packer.scan([("int0", ">", 22)], n=27))
+    assert [x.id for x in resp] == [23, 24, 25, 26]
+    # only log_0 was opened
+    assert unpack_from.call_count == 7
+
+
+def test_scan_no_stats_after_incorporate(tmp_path):
+    packer = PackedRotatingLog(
+        "log", str(tmp_path), 2, 2, 8, log_lines=10, keep_logs=2, stats=True
+    )
+    exp = fill(packer, 15)
+    packer = PackedRotatingLog(
+        "log", str(tmp_path), 2, 2, 8, log_lines=10, keep_logs=2, stats=True
+    )
+    assert packer._stats == [None]
+    packer.append(floats=[0, 0], ints=[99, 0], bools=[False] * 8)
+    resp = list(packer.scan([("int0", ">", 12)], n=16))
+    assert [x.ints[0] for x in resp] == [13, 14, 99]
+
+
+def test_scan_bad_predicate(packer):
+    packer, tmp_path = packer
+    with pytest.raises(ValueError, match="Unknown operator"):
+        packer.predicate([("int0", "~", 3)])
+    with pytest.raises(ValueError, match="Bools only"):
+        packer.predicate([("bool0", ">", 0)])
+
+
+def test_cache_scan(tmp_path):
+    packer = PackedRotatingLog(
+        "log", str(tmp_path), 2, 2, 8, log_lines=10, keep_logs=2, cache=12
+    )
+    exp = fill(packer)
+    assert len(packer._cache) == 12
+    assert list(packer.read(n=10)) == exp[-10:]
+    resp = list(packer.scan(["bool0"], n=10, columns=("int0",), tuples=True))
+    assert resp == [(x.id, x.ints[0]) for x in exp[-10:] if x.bools[0]]
+
+    packer = PackedRotatingLog(
+        "log", str(tmp_path), 2, 2, 8, log_lines=10, keep_logs=2, cache_bytes=100
+    )
+    assert len(packer._cache) == 100 // packer.line_size
+    assert list(packer.read(n=3)) == exp[-3:]
+
+
+@pytest.mark.parametrize("timestamp", [True, False])
+@pytest.mark.parametrize("n,skip", regions)
+def test_read_blocks(n, skip, timestamp, packer, mocker):
+    packer, tmp_path = packer
+    packer.timestamp = timestamp
+    packer.checksum = True
+    mocker.patch("time.time", side_effect=seq())
+    fill(packer, 17)
+
+    exp = list(packer.read(n=n, skip=skip))
+    blocks = list(packer.read_blocks(n=n, skip=skip, block_size=4))
+    assert all(len(x) <= 4 for x in blocks)
+    assert sum(len(x) for x in blocks) == len(exp)
+    resp = []
+    for block in blocks:
+        assert isinstance(block.floats, array)
+        for i in range(len(block)):
+            resp.append(
+                Line(
+                    block.id + i,
+                    tuple(block.floats[2 * i : 2 * i + 2]),
+                    tuple(block.ints[2 * i : 2 * i + 2]),
+                    tuple(unpack_bools(block.bools[i])),
+                    time.localtime(block.timestamps[i]) if timestamp else None,
+                )
+            )
+    assert resp == exp
+
+
+def test_read_blocks_no_floats(tmp_path):
+    packer = PackedRotatingLog("log", str(tmp_path), 0, 1, 0, log_lines=10)
+    for i in range(15):
+        packer.append(ints=[i])
+    (block,) = packer.read_blocks(n=5, block_size=10)
+    assert list(block.ints) == [10, 11, 12, 13, 14]
+    assert len(block.floats) == 0
+    assert block.bools == b""
+    assert block.timestamps is None
+
+
+def test_read_blocks_no_frombytes(packer, mocker):
+    packer, tmp_path = packer
+    fill(packer, 17)
+    exp = list(packer.read_blocks(n=15))
+    mocker.patch("packing.packed._frombytes", False)
+    resp = list(packer.read_blocks(n=15))
+    for a, b in zip(exp, resp):
+        assert (a.id, a.floats, a.ints, a.bools) == (b.id, b.floats, b.ints, b.bools)
+
+
+@pytest.mark.parametrize("first", [0, 3])
+def test_scan_stats_nan(first, tmp_path):
+    packer = PackedRotatingLog("log", str(tmp_path), 1, 0, 0, log_lines=10, stats=True)
+    values = [0.0, 1.0, 2.0, 3.0, 4.0]
+    values.insert(first, float("nan"))
+    for x in values:
+        packer.append(floats=[x])
+    exp = [i for i, x in enumerate(values) if x > 2]
+    assert [x.id for x in packer.scan([("float0", ">", 2)])] == exp
+    exp = [i for i, x in enumerate(values) if x != 1]
+    assert [x.id for x in packer.scan([("float0", "!=", 1)])] == exp
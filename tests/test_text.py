@@ -1,5 +1,8 @@
-from packing.text import RotatingLog, Line
+from packing import text
+from packing.text import RotatingLog, Line, Ring
+from packing.metrics import Metrics
 import pytest
+import os
 import time
 
 
@@ -311,3 +314,300 @@ def test_insufficient_space(mocker, tmp_path):
     statvfs.return_value = (1, 0, 0, 0, 7)
     with pytest.raises(Exception, match="Insufficient space in outdir"):
         log = RotatingLog("log", str(tmp_path), log_lines=10, keep_logs=1)
+
+
+def count_lines(lines):
+    return sum(1 for _ in lines)
+
+
+@pytest.mark.parametrize("threads", [True, False])
+def test_read_parallel(threads, log):
+    log, outdir = log
+    log.keep_logs = 2
+    exp = []
+    for i in range(25):
+        l = f"test line {i}"
+        log.append(l)
+        exp.append(Line(i, None, l))
+
+    assert list(log.read_parallel(workers=2, threads=threads)) == exp
+    assert list(log.read_parallel(threads=threads)) == list(log.read(n=25))
+
+
+@pytest.mark.parametrize("threads", [True, False])
+def test_map_files(threads, log):
+    log, outdir = log
+    log.keep_logs = 2
+    for i in range(25):
+        log.append(f"test line {i}")
+
+    resp = list(log.map_files(count_lines, workers=2, threads=threads))
+    assert resp == [10, 10, 5]
+
+
+def test_map_files_window(tmp_path, mocker):
+    log = RotatingLog("log", str(tmp_path), log_lines=2, keep_logs=20, cache=10)
+    for i in range(41):
+        log.append(f"test line {i}")
+    map_file = mocker.spy(text, "_map_file")
+    files = log.map_files(list, workers=1, threads=True)
+    assert next(files) == [Line(i, None, f"test line {i}") for i in (0, 1)]
+    # no more than 2 files per worker are read ahead of the consumer
+    assert map_file.call_count <= 2
+    state = map_file.call_args.args[2]
+    assert state["_cache"] is None
+    assert state["_file_bytes"] is None
+    files.close()
+
+
+def test_recover_torn_line(log):
+    log, outdir = log
+    for i in range(5):
+        log.append(f"test line {i}")
+    with (outdir / "log_0.log").open("a") as f:
+        f.write("test li")
+
+    log = RotatingLog("log", str(outdir), log_lines=10)
+    assert log.pos == 5
+    with (outdir / "log_0.log").open() as f:
+        assert f.read().endswith("test line 4\n")
+    log.append("new line")
+    assert [x.line for x in log.read(n=2)] == ["test line 4", "new line"]
+
+
+def test_recover_torn_only_line(log):
+    log, outdir = log
+    with (outdir / "log_0.log").open("w") as f:
+        f.write("test li")
+    log = RotatingLog("log", str(outdir), log_lines=10)
+    assert log.pos == 0
+    assert (outdir / "log_0.log").read_text() == ""
+
+
+def test_recover_interrupted_rotation(log):
+    log, outdir = log
+    log.keep_logs = 3
+    for i in range(30):
+        log.append(f"test line {i}")
+    # crash after renaming log_2 -> log_3 but before log_1 -> log_2
+    (outdir / "log_2.log").rename(outdir / "log_3.log")
+    log = RotatingLog("log", str(outdir), log_lines=10, keep_logs=3)
+    assert sorted(log.logs_in_outdir()) == [1, 2, 3]
+    assert log.pos == 0
+    log.append("new line")
+    lines = [x.line for x in log.read(n=31)]
+    assert lines == [f"test line {i}" for i in range(30)] + ["new line"]
+
+
+@pytest.mark.parametrize("keep_logs", [0, 1, 2])
+def test_cache_read(keep_logs, tmp_path):
+    log = RotatingLog("log", str(tmp_path), log_lines=10, keep_logs=keep_logs)
+    cached = RotatingLog(
+        "cached", str(tmp_path), log_lines=10, keep_logs=keep_logs, cache=15
+    )
+    for i in range(27):
+        log.append(f"test line {i}")
+        cached.append(f"test line {i}")
+        for n, skip in regions:
+            assert list(cached.read(n=n, skip=skip)) == list(log.read(n=n, skip=skip))
+
+
+def test_cache_no_io(tmp_path, mocker):
+    log = RotatingLog("log", str(tmp_path), log_lines=10, cache=5)
+    for i in range(17):
+        log.append(f"test line {i}")
+    mocker.patch("packing.text.open", side_effect=AssertionError, create=True)
+    assert [x.line for x in log.read(n=5)] == [f"test line {i}" for i in range(12, 17)]
+    assert [x.id for x in log.read(n=2, skip=3)] == [12, 13]
+    with pytest.raises(AssertionError):
+        list(log.read(n=6))
+
+
+def test_cache_bytes(tmp_path):
+    log = RotatingLog("log", str(tmp_path), log_lines=10, cache_bytes=30)
+    for i in range(5):
+        log.append(f"line {i}")
+    assert list(log._cache) == ["line 1", "line 2", "line 3", "line 4"]
+    assert log._cache_size == 28
+
+
+def test_cache_incorporate(log):
+    log, outdir = log
+    for i in range(15):
+        log.append(f"test line {i}")
+    log = RotatingLog("log", str(outdir), log_lines=10, cache=8)
+    assert list(log._cache) == [f"test line {i}" for i in range(7, 15)]
+    log.append("new line")
+    assert [x.line for x in log.read(n=3)] == [
+        "test line 13",
+        "test line 14",
+        "new line",
+    ]
+
+
+def test_metrics(tmp_path):
+    events = []
+    metrics = Metrics(hook=lambda name, value: events.append(name))
+    log = RotatingLog("log", str(tmp_path), log_lines=10, keep_logs=1, metrics=metrics)
+    for i in range(25):
+        log.append(f"line {i:02}")
+    assert len(list(log.read(n=15))) == 15
+
+    snapshot = metrics.snapshot()
+    assert snapshot["counters"] == {
+        "appends": 25,
+        "bytes_written": 25 * 8,
+        "rotations": 2,
+        "files_removed": 1,
+        "records_read": 15,
+    }
+    assert sum(snapshot["histograms"]["writeln_us"]) == 25
+    assert sum(snapshot["histograms"]["rotate_logs_us"]) == 2
+    assert sum(snapshot["histograms"]["read_us"]) == 1
+    assert sum(snapshot["histograms"]["incorporate_logs_us"]) == 1
+    assert events.count("appends") == 25
+    assert "read_us" in events
+
+    # reading back the logs on startup is not read traffic
+    metrics.reset()
+    log = RotatingLog("log", str(tmp_path), log_lines=10, cache=10, metrics=metrics)
+    assert "records_read" not in metrics.counters
+    assert "read_us" not in metrics.histograms
+    assert len(log._cache) == 10
+
+    log.append("température")
+    assert metrics.counters["bytes_written"] == len("température".encode()) + 1
+
+
+def test_metrics_disabled(log):
+    log, outdir = log
+    assert "writeln" not in log.__dict__
+    assert "read" not in log.__dict__
+
+
+def test_metrics_buckets():
+    metrics = Metrics(buckets=4)
+    for us in (0, 1, 2, 3, 4, 1000):
+        metrics.observe("x", us)
+    assert metrics.histograms["x"] == [1, 1, 2, 2]
+
+
+def test_metrics_read_parallel(log):
+    log, outdir = log
+    log = RotatingLog("log", str(outdir), log_lines=10, metrics=Metrics())
+    for i in range(15):
+        log.append(f"test line {i}")
+    assert len(list(log.read_parallel(workers=2))) == 15
+
+
+def test_max_bytes(tmp_path):
+    log = RotatingLog("log", str(tmp_path), log_lines=10, keep_logs=10, max_bytes=250)
+    exp = []
+    for i in range(45):
+        l = f"line {i:03}"
+        log.append(l)
+        exp.append(Line(i, None, l))
+        assert log._bytes <= 250
+        assert log._bytes == sum(
+            f.stat().st_size for f in tmp_path.iterdir() if f.suffix == ".log"
+        )
+    # 9 bytes a line: log_0 and two full files fit
+    assert sorted(log.logs_in_outdir()) == [0, 1, 2]
+    assert list(log.read(n=45)) == exp[-25:]
+    assert list(log.read(n=5, skip=18)) == exp[-23:-18]
+
+    log = RotatingLog("log", str(tmp_path), log_lines=10, keep_logs=10, max_bytes=150)
+    assert sorted(log.logs_in_outdir()) == [0, 1]
+    assert log._bytes == 135
+
+
+def test_max_bytes_non_ascii(tmp_path):
+    log = RotatingLog("log", str(tmp_path), log_lines=10, keep_logs=10, max_bytes=300)
+    for i in range(45):
+        log.append(f"température {i:02}")
+        assert log._bytes <= 300
+        assert log._bytes == sum(
+            f.stat().st_size for f in tmp_path.iterdir() if f.suffix == ".log"
+        )
+    # 16 bytes a line on disk, but only 15 characters
+    assert sorted(log.logs_in_outdir()) == [0, 1]
+    log = RotatingLog("log", str(tmp_path), log_lines=10, keep_logs=10, max_bytes=300)
+    assert log._bytes == 240
+
+
+def test_max_bytes_below_log_0(tmp_path, mocker):
+    metrics = Metrics()
+    log = RotatingLog(
+        "log", str(tmp_path), log_lines=10, keep_logs=10, max_bytes=50, metrics=metrics
+    )
+    listdir = mocker.spy(os, "listdir")
+    for i in range(50):
+        log.append(f"line {i:03}")
+    # only log_0 is kept, and it is only looked at again once it rotates
+    assert listdir.call_count <= 3 * metrics.counters["rotations"] + 1
+    assert sorted(log.logs_in_outdir()) == [0]
+    assert metrics.counters["over_budget"] == 5
+
+
+def test_max_age(tmp_path, mocker):
+    mocked_time = mocker.patch("time.time")
+    mocked_time.return_value = 1000
+    log = RotatingLog("log", str(tmp_path), log_lines=10, keep_logs=10, max_age=60)
+    for i in range(35):
+        mocked_time.return_value = 1000 + i * 10
+        log.append(f"line {i:03}")
+    # log_3 was last written at t=1090, log_2 at 1190 and log_1 at 1290
+    assert sorted(log.logs_in_outdir()) == [0, 1]
+    assert [x.line for x in log.read(n=35)] == [f"line {i:03}" for i in range(20, 35)]
+
+
+def test_periodic_space_check(tmp_path, mocker):
+    log = RotatingLog(
+        "log",
+        str(tmp_path),
+        log_lines=10,
+        keep_logs=10,
+        max_bytes=10000,
+        check_interval=5,
+    )
+    for i in range(30):
+        log.append(f"line {i:03}")
+    statvfs = mocker.patch("os.statvfs")
+    statvfs.return_value = (1, 0, 0, 0, 7)
+    for i in range(4):
+        log.append(f"line {i:03}")
+    statvfs.assert_not_called()
+    log.append("line")
+    statvfs.assert_called_once()
+    assert sorted(log.logs_in_outdir()) == [0, 1, 2]
+
+
+def test_readonly(tmp_path):
+    log = RotatingLog("log", str(tmp_path), log_lines=10, keep_logs=3)
+    for i in range(30):
+        log.append(f"line {i:03}")
+    before = {x.name: x.read_bytes() for x in tmp_path.iterdir()}
+    log = RotatingLog("log", str(tmp_path), log_lines=10, keep_logs=3, readonly=True)
+    assert log.abs_pos == 30
+    assert [x.line for x in log.read(n=30)] == [f"line {i:03}" for i in range(30)]
+    with pytest.raises(OSError):
+        log.append("line")
+    with pytest.raises(ValueError, match="log_lines is 20"):
+        RotatingLog("log", str(tmp_path), log_lines=20, readonly=True)
+    (tmp_path / "log_1.log").unlink()
+    with pytest.raises(ValueError, match="not consecutive"):
+        RotatingLog("log", str(tmp_path), log_lines=10, readonly=True)
+    del before["log_1.log"]
+    assert {x.name: x.read_bytes() for x in tmp_path.iterdir()} == before
+
+
+def test_ring():
+    ring = Ring(3)
+    for i in range(10):
+        ring.append(i)
+    assert list(ring) == list(range(10))
+    for i in range(7):
+        assert ring.popleft() == i
+        ring.append(10 + i)
+    assert list(ring) == [7, 8, 9] + list(range(10, 17))
+    assert (ring[0], ring[-1], len(ring)) == (7, 16, 10)
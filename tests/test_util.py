@@ -1,7 +1,8 @@
 import packing
 
 print(dir(packing))
-from packing.util import pack_bools, unpack_bools
+from packing.util import pack_bools, unpack_bools, varint, unpack_varint
+import pytest
 
 
 def test_pack_bools_all():
@@ -20,3 +21,15 @@ def test_pack_bools_mix():
     resp = pack_bools([True, False] * 4)
     assert resp == 0b01010101
     assert unpack_bools(resp) == [True, False] * 4
+
+
+def test_varint():
+    for n in (0, 1, 127, 128, 300, 2**35 + 7):
+        assert unpack_varint(varint(n)) == (n, len(varint(n)))
+    assert varint(300) == b"\xac\x02"
+    assert unpack_varint(b"\x00" + varint(300), 1) == (300, 3)
+
+
+def test_varint_truncated():
+    with pytest.raises(IndexError):
+        unpack_varint(varint(300)[:1])